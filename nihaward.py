@@ -22,8 +22,6 @@ except ImportError:
     import xml.etree.ElementTree as ET
 
 import re
-from bs4 import BeautifulSoup
-import urllib.request
 import shutil
 import os 
 import zipfile
@@ -167,6 +165,10 @@ class NIHAwardFile:
         
     def find_zip_file_urls(self):
         """Returns a list of all XML-based ExPORTER zip files for this instance's fiscal year."""
+        # Imported here rather than at module level so that parse-only use never pays for the HTML and network stack.
+        from bs4 import BeautifulSoup
+        import urllib.request
+        
         urls = []
         
         page = urllib.request.urlopen(self.NIH_EXPORTER_SITE + self.NIH_EXPORTER_PAGE)
@@ -222,6 +224,8 @@ class NIHAwardFile:
             # There is a corresponding XML file of that name so do nothing but send back this file name.
             xmlfilename = os.path.splitext(localfile)[0] + '.xml'
         else:
+            import urllib.request
+            
             with urllib.request.urlopen(url) as response, open(localfile, 'wb') as out_file:
                 shutil.copyfileobj(response, out_file)
             
@@ -0,0 +1,271 @@
+"""
+This module turns NIH award data into fixed-size columnar batches of NumPy arrays for analytics, either straight
+from the nihaward parser or from the NIH_PROJECT table built by nihloader.
+
+Each batch holds one array per field rather than one Python object per award. Integer fields are int64, date fields
+are datetime64[D] (NaT when missing) and categorical strings such as administering_ic and org_state are dictionary
+encoded as int32 codes into a list of categories that is shared, and kept consistent, across every batch of a run.
+
+Batches can optionally be spilled to .npy files in a directory and handed back as read-only memory maps, so that
+aggregations over fields such as total_cost can run vectorized over many fiscal years without holding them in memory.
+
+@author: Britton Ward (brittonward.com)
+
+"""
+
+
+import os
+import sqlite3 as sqlite
+from datetime import date
+
+import numpy as np
+
+
+DEFAULT_BATCH_SIZE = 65536
+
+# Field kinds and the NumPy storage type used while a batch is being filled.
+_INT = 'int'
+_DATE = 'date'
+_CATEGORY = 'category'
+_STORAGE_DTYPES = {_INT: np.int64, _DATE: np.int64, _CATEGORY: np.int32}
+
+# Supported fields named after the NIHAward attributes, with their kind.
+FIELDS = {
+    'application_id': _INT,
+    'fy': _INT,
+    'org_district': _INT,
+    'total_cost': _INT,
+    'total_cost_sub_project': _INT,
+    'award_notice_date': _DATE,
+    'budget_start': _DATE,
+    'budget_end': _DATE,
+    'project_start': _DATE,
+    'project_end': _DATE,
+    'activity': _CATEGORY,
+    'administering_ic': _CATEGORY,
+    'application_type': _CATEGORY,
+    'arra_funded': _CATEGORY,
+    'ic_name': _CATEGORY,
+    'org_country': _CATEGORY,
+    'org_state': _CATEGORY,
+}
+
+# NIH_PROJECT columns whose name differs from the NIHAward attribute.
+_PROJECT_COLUMNS = {'project_start': 'project_start_date', 'project_end': 'project_end_date'}
+
+# Dates are held as days since the Unix epoch so the arrays can be viewed as datetime64[D].
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_NAT = np.iinfo(np.int64).min
+
+
+def _to_int(value):
+    """Conform an integer field, treating missing values as 0 the same way NIHAward does."""
+    if value is None or value == '':
+        return 0
+
+    return int(value)
+
+
+def _to_day(value):
+    """Conform a date field to days since the epoch. Accepts dates from the parser, ISO text from a default
+    database and integer day numbers from a compact storage database."""
+    if value is None or value == '':
+        return _NAT
+    elif isinstance(value, int):
+        return value - _EPOCH_ORDINAL
+    elif isinstance(value, str):
+        return date.fromisoformat(value[:10]).toordinal() - _EPOCH_ORDINAL
+    else:
+        return value.toordinal() - _EPOCH_ORDINAL
+
+
+class AwardColumnBatch:
+    """A fixed-size slice of awards held as one NumPy array per field."""
+
+    def __init__(self, columns, categories):
+        # columns maps field name to array and categories maps each categorical field to its list of values.
+        self.columns = columns
+        self.categories = categories
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def __getitem__(self, field):
+        return self.columns[field]
+
+    def decode(self, field):
+        """Returns a categorical field's values as an object array of strings rather than codes."""
+        return np.asarray(self.categories[field], dtype=object)[self.columns[field]]
+
+
+class _BatchBuilder:
+    """Fills preallocated arrays one award at a time and hands them back as AwardColumnBatch objects."""
+
+    def __init__(self, fields, batch_size, spill_directory):
+        if batch_size < 1:
+            raise RuntimeError('batch_size must be at least 1')
+
+        if len(fields) == 0:
+            raise RuntimeError('At least one columnar field is required')
+
+        for field in fields:
+            if field not in FIELDS:
+                raise RuntimeError('Unsupported columnar field: ' + field)
+
+        self.fields = fields
+        self.batch_size = batch_size
+        self.spill_directory = spill_directory
+        self.batch_number = 0
+
+        # The category lists are shared by every batch so codes mean the same thing from batch to batch.
+        self.categories = {field: [] for field in fields if FIELDS[field] == _CATEGORY}
+        self._category_codes = {field: {} for field in self.categories}
+
+        self.converters = []
+        for field in fields:
+            if FIELDS[field] == _INT:
+                self.converters.append(_to_int)
+            elif FIELDS[field] == _DATE:
+                self.converters.append(_to_day)
+            else:
+                self.converters.append(self._category_encoder(field))
+
+        if spill_directory is not None:
+            os.makedirs(spill_directory, exist_ok=True)
+
+        self._reset()
+
+    def _category_encoder(self, field):
+        codes = self._category_codes[field]
+        values = self.categories[field]
+
+        def encode(value):
+            if value is None:
+                value = ''
+            code = codes.get(value)
+            if code is None:
+                code = len(values)
+                codes[value] = code
+                values.append(value)
+            return code
+
+        return encode
+
+    def _reset(self):
+        self.arrays = [np.empty(self.batch_size, dtype=_STORAGE_DTYPES[FIELDS[field]]) for field in self.fields]
+        self.count = 0
+
+    def append(self, values):
+        """Add one award's values, in field order. Returns True once the batch is full."""
+        i = self.count
+        for array, convert, value in zip(self.arrays, self.converters, values):
+            array[i] = convert(value)
+
+        self.count += 1
+        return self.count == self.batch_size
+
+    def flush(self):
+        """Returns the filled portion of the current batch and starts a new one."""
+        columns = {}
+        for field, array in zip(self.fields, self.arrays):
+            array = array[:self.count]
+            if FIELDS[field] == _DATE:
+                array = array.view('datetime64[D]')
+
+            if self.spill_directory is not None:
+                path = os.path.join(self.spill_directory, '%s.%06d.npy' % (field, self.batch_number))
+                np.save(path, array)
+                array = np.load(path, mmap_mode='r')
+
+            columns[field] = array
+
+        # Rewrite the category lists with every spilled batch so the spill directory can always be decoded, even
+        # when the caller stops iterating early or the run fails partway through.
+        if self.spill_directory is not None:
+            self._save_categories()
+
+        self.batch_number += 1
+        self._reset()
+
+        return AwardColumnBatch(columns, self.categories)
+
+    def _save_categories(self):
+        for field, values in self.categories.items():
+            np.save(os.path.join(self.spill_directory, field + '.categories.npy'), np.array(values, dtype=str))
+
+
+def award_batches(award_file, batch_size=DEFAULT_BATCH_SIZE, fields=None, spill_directory=None):
+    """
+    Generator of AwardColumnBatch objects built straight from an NIHAwardFile's awarditer(). The files must already
+    be downloaded with get_files_in_fiscal_year_range(). Fields default to all of FIELDS. If spill_directory is given
+    each batch is written there as .npy files and its arrays are memory maps of those files. Use an empty
+    spill_directory for each run since existing batch files are overwritten but not removed.
+
+    """
+    if fields is None:
+        fields = list(FIELDS)
+
+    builder = _BatchBuilder(fields, batch_size, spill_directory)
+
+    for award in award_file.awarditer():
+        if builder.append([getattr(award, field) for field in fields]):
+            yield builder.flush()
+
+    if builder.count > 0:
+        yield builder.flush()
+
+
+def project_batches(database_file_name, batch_size=DEFAULT_BATCH_SIZE, fields=None, spill_directory=None, where_clause=None, parameters=None):
+    """
+    Generator of AwardColumnBatch objects read from the NIH_PROJECT table, optionally filtered by a SQL where_clause
+    (without the WHERE keyword) and its parameters. Works with databases created with or without compact storage.
+    Fields and spill_directory behave as in award_batches.
+
+    """
+    if fields is None:
+        fields = list(FIELDS)
+
+    builder = _BatchBuilder(fields, batch_size, spill_directory)
+
+    sql_query = "SELECT " + ", ".join(_PROJECT_COLUMNS.get(field, field) for field in fields) + " FROM NIH_PROJECT"
+    if where_clause is not None:
+        sql_query += " WHERE " + where_clause
+
+    # No detect_types here: the raw stored values convert into arrays more cheaply than date objects do.
+    con = sqlite.connect(database_file_name)
+    try:
+        cur = con.cursor()
+
+        if parameters is None:
+            cur.execute(sql_query)
+        else:
+            cur.execute(sql_query, parameters)
+
+        rows = cur.fetchmany(batch_size)
+        while rows:
+            for row in rows:
+                builder.append(row)
+            yield builder.flush()
+            rows = cur.fetchmany(batch_size)
+    finally:
+        con.close()
+
+
+def load_spilled_batches(spill_directory, fields=None):
+    """Generator of AwardColumnBatch objects, as memory maps, for batches previously spilled to spill_directory."""
+    if fields is None:
+        fields = [field for field in FIELDS if os.path.isfile(os.path.join(spill_directory, '%s.%06d.npy' % (field, 0)))]
+
+    categories = {}
+    for field in fields:
+        if FIELDS[field] == _CATEGORY:
+            categories[field] = np.load(os.path.join(spill_directory, field + '.categories.npy')).tolist()
+
+    batch_number = 0
+    while fields and os.path.isfile(os.path.join(spill_directory, '%s.%06d.npy' % (fields[0], batch_number))):
+        columns = {}
+        for field in fields:
+            columns[field] = np.load(os.path.join(spill_directory, '%s.%06d.npy' % (field, batch_number)), mmap_mode='r')
+
+        yield AwardColumnBatch(columns, categories)
+        batch_number += 1
@@ -5,6 +5,11 @@ The main function for usage is load_fiscal_year_range, which imports the data us
 inserts the awards/projects into the sqlite database. This is a bit of a monolith but my goal is only to get the
 data in the database for later extraction.
 
+It can also be run from the command line, e.g. "python -m nihloader load --start 2000 --end 2013 --cache-dir downloads".
+Run "python -m nihloader --help" for the download, parse, load and update commands and their options. Note that
+parse is a separate columnar export for analytics rather than a stage of load, which parses the XML files itself, so
+--workers, --batch-size and --columns-dir are only accepted by parse.
+
 @author: Britton Ward (brittonward.com)
 
 """
@@ -13,10 +18,88 @@ data in the database for later extraction.
 import sys
 from nihaward import NIHAwardFile
 import os
+import random
+import re
+import shutil
 import sqlite3 as sqlite
+from datetime import date
+from collections import OrderedDict
+import threading
+import time
+
+
+# Declared column type used for dates in compact storage. The first word is the key sqlite uses to find the
+# converter under PARSE_DECLTYPES and the trailing INTEGER gives the column integer affinity.
+DAY_NUMBER_TYPE = 'DAYNUM INTEGER'
+
+
+def to_day_number(value):
+    """Convert a date to the integer day number (proleptic Gregorian ordinal) used by compact storage.
+    Empty values become None so they are stored as NULL."""
+    if value is None or value == '':
+        return None
+    
+    return value.toordinal()
+
+
+def _keep_date(value):
+    """Dates are bound unchanged, and stored as ISO text by sqlite, outside of compact storage."""
+    return value
+
+
+class DayNumber:
+    """
+    Wraps a date bound as a query parameter against a compact storage database, e.g.
+    "WHERE project_start_date BETWEEN ? AND ?" with (DayNumber(date(2012, 7, 1)), DayNumber(date(2012, 9, 30))).
+    A plain date would be bound as ISO text and silently match nothing in the integer day number columns.
+    
+    """
+    
+    def __init__(self, value):
+        self.value = value
+    
+    # Equal and hashable by date so identical queries share a QueryResultCache entry.
+    def __eq__(self, other):
+        return isinstance(other, DayNumber) and self.value == other.value
+    
+    def __hash__(self):
+        return hash(self.value)
+    
+    def __repr__(self):
+        return 'DayNumber(%r)' % (self.value,)
 
-def create_nih_tables(database_file_name, is_create_term_table=False, is_create_pi_table=False):
-    """Create all NIH tables necessary for storing an NIH award project."""
+
+def adapt_day_number(day_number):
+    """sqlite adapter that binds a DayNumber as its integer day number."""
+    return to_day_number(day_number.value)
+
+
+def convert_day_number(value):
+    """sqlite converter that turns a stored day number back into a date."""
+    return date.fromordinal(int(value))
+
+
+sqlite.register_adapter(DayNumber, adapt_day_number)
+sqlite.register_converter('DAYNUM', convert_day_number)
+
+
+def create_nih_tables(database_file_name, is_create_term_table=False, is_create_pi_table=False, is_compact_storage=False):
+    """
+    Create all NIH tables necessary for storing an NIH award project.
+    
+    With is_compact_storage, dates are stored as integer day numbers and costs as integers rather than as TEXT and
+    NUMERIC. Date parameters in queries against such a database must then be day numbers, so wrap them in DayNumber.
+    Either way the common date-range and cost columns are indexed. A RuntimeError is raised if NIH_PROJECT already
+    exists with the other storage mode.
+    
+    """
+    if is_compact_storage:
+        date_type = DAY_NUMBER_TYPE
+        cost_type = 'INTEGER'
+    else:
+        date_type = 'TEXT'
+        cost_type = 'NUMERIC'
+    
     #there is no except clause so that errors will automatically be re-raised.
     con = sqlite.connect(database_file_name)
     
@@ -32,7 +115,7 @@ def create_nih_tables(database_file_name, is_create_term_table=False, is_create_
             CONSTRAINT NIH_SOURCE_FILE_UK1 UNIQUE (source_file_name, source_file_date)
         )""")
             
-        cur.execute("""CREATE TABLE IF NOT EXISTS NIH_PROJECT (
+        cur.execute(f"""CREATE TABLE IF NOT EXISTS NIH_PROJECT (
             nih_project_id INTEGER PRIMARY KEY,
             application_id INTEGER NOT NULL,
             is_current_application_id TEXT DEFAULT 'N' NOT NULL,
@@ -42,9 +125,9 @@ def create_nih_tables(database_file_name, is_create_term_table=False, is_create_
             administering_ic TEXT,
             application_type TEXT,
             arra_funded TEXT,
-            award_notice_date TEXT,
-            budget_start TEXT,
-            budget_end TEXT,
+            award_notice_date {date_type},
+            budget_start {date_type},
+            budget_end {date_type},
             cfda_code INTEGER,
             core_project_num TEXT,
             ed_inst_type TEXT,
@@ -65,8 +148,8 @@ def create_nih_tables(database_file_name, is_create_term_table=False, is_create_
             org_zipcode TEXT,
             phr TEXT,
             program_officer_name TEXT,
-            project_start_date TEXT,
-            project_end_date TEXT,
+            project_start_date {date_type},
+            project_end_date {date_type},
             project_title TEXT,
             serial_number TEXT,
             study_section TEXT,
@@ -74,14 +157,36 @@ def create_nih_tables(database_file_name, is_create_term_table=False, is_create_
             subproject_id TEXT,
             suffix TEXT,
             support_year TEXT,
-            total_cost NUMERIC,
-            total_cost_sub_project NUMERIC,
+            total_cost {cost_type},
+            total_cost_sub_project {cost_type},
             CONSTRAINT NIH_PROJECT_UK1 UNIQUE (application_id, nih_source_file_id),
             CONSTRAINT NIH_PROJECT_is_current_application_id_CK CHECK(is_current_application_id IN ('Y', 'N')),
             CONSTRAINT NIH_PROJECT_nih_source_file_id_FK FOREIGN KEY (nih_source_file_id)
                 REFERENCES NIH_SOURCE_FILE (nih_source_file_id)
         )""")
         
+        # CREATE TABLE IF NOT EXISTS keeps an existing table as is, so make sure it uses the requested storage mode.
+        cur.execute("PRAGMA table_info(NIH_PROJECT)")
+        existing_date_type = [row[2] for row in cur.fetchall() if row[1] == 'project_start_date'][0]
+        if existing_date_type.upper() != date_type:
+            if existing_date_type.upper() == DAY_NUMBER_TYPE:
+                raise RuntimeError('NIH_PROJECT was created with compact storage; pass is_compact_storage=True')
+            else:
+                raise RuntimeError('NIH_PROJECT was created without compact storage; pass is_compact_storage=False')
+        
+        # A new database starts its load generation at a random value rather than 0, so that QueryResultCache never
+        # mistakes a database that was deleted and created again for the old one.
+        cur.execute("PRAGMA user_version")
+        if cur.fetchone()[0] == 0:
+            cur.execute("PRAGMA user_version = %d" % random.randrange(1, 2 ** 30))
+        
+        # Indexes so that date-range and cost filters become index range scans instead of full table scans.
+        cur.execute("CREATE INDEX IF NOT EXISTS NIH_PROJECT_IX1 ON NIH_PROJECT (project_start_date, total_cost)")
+        cur.execute("CREATE INDEX IF NOT EXISTS NIH_PROJECT_IX2 ON NIH_PROJECT (project_end_date)")
+        cur.execute("CREATE INDEX IF NOT EXISTS NIH_PROJECT_IX3 ON NIH_PROJECT (budget_start)")
+        cur.execute("CREATE INDEX IF NOT EXISTS NIH_PROJECT_IX4 ON NIH_PROJECT (award_notice_date)")
+        cur.execute("CREATE INDEX IF NOT EXISTS NIH_PROJECT_IX5 ON NIH_PROJECT (total_cost)")
+        
         if is_create_term_table:
             cur.execute("""CREATE TABLE IF NOT EXISTS NIH_PROJECT_TERM (
                 nih_project_term_id INTEGER PRIMARY KEY,
@@ -112,8 +217,17 @@ def insert_source_file(cur, source_file_name, source_file_date, fiscal_year):
     return cur.lastrowid
     
 
-def insert_project(cur, nih_award_file, nih_source_file_id):
-    """Insert all project attributes (except terms and project investigators) from a particular NIH award file item."""
+def insert_project(cur, nih_award_file, nih_source_file_id, is_compact_storage=False):
+    """
+    Insert all project attributes (except terms and project investigators) from a particular NIH award file item.
+    is_compact_storage must match the setting the tables were created with.
+    
+    """
+    if is_compact_storage:
+        adapt_date = to_day_number
+    else:
+        adapt_date = _keep_date
+    
     cur.execute("""INSERT INTO NIH_PROJECT (
                     application_id,
                     nih_source_file_id,
@@ -169,9 +283,9 @@ def insert_project(cur, nih_award_file, nih_source_file_id):
                  nih_award_file.administering_ic,
                  nih_award_file.application_type,
                  nih_award_file.arra_funded,
-                 nih_award_file.award_notice_date,
-                 nih_award_file.budget_start,
-                 nih_award_file.budget_end,
+                 adapt_date(nih_award_file.award_notice_date),
+                 adapt_date(nih_award_file.budget_start),
+                 adapt_date(nih_award_file.budget_end),
                  nih_award_file.cfda_code,
                  nih_award_file.core_project_num,
                  nih_award_file.ed_inst_type,
@@ -192,8 +306,8 @@ def insert_project(cur, nih_award_file, nih_source_file_id):
                  nih_award_file.org_zipcode,
                  nih_award_file.phr,
                  nih_award_file.program_officer_name,
-                 nih_award_file.project_start,
-                 nih_award_file.project_end,
+                 adapt_date(nih_award_file.project_start),
+                 adapt_date(nih_award_file.project_end),
                  nih_award_file.project_title,
                  nih_award_file.serial_number,
                  nih_award_file.study_section,
@@ -219,9 +333,9 @@ def insert_project_investigators(cur, nih_award_file, nih_project_id):
         cur.execute("INSERT INTO NIH_PROJECT_INVESTIGATOR(nih_project_id, pi_id, pi_name) VALUES(?,?,?)", (nih_project_id, pi["pi_id"], pi["pi_name"]))
 
 
-def insert_award_file(cur, nih_award_file, nih_source_file_id, is_insert_term, is_insert_pi):
+def insert_award_file(cur, nih_award_file, nih_source_file_id, is_insert_term, is_insert_pi, is_compact_storage=False):
     """For a particular NIH award file item, insert all parts of it unless specified otherwise."""
-    nih_project_id = insert_project(cur, nih_award_file, nih_source_file_id)
+    nih_project_id = insert_project(cur, nih_award_file, nih_source_file_id, is_compact_storage)
     
     if is_insert_term:
         insert_project_terms(cur, nih_award_file, nih_project_id)
@@ -249,6 +363,104 @@ def get_rows_from_query(database_file_name, sql_query, parameters=None):
     
     return rows
 
+def increment_load_generation(cur):
+    """
+    Bump the database's load generation counter, kept in sqlite's user_version, so that cached query results are
+    invalidated. Call it inside the transaction that changes the data so both become visible at the same commit.
+    """
+    cur.execute("PRAGMA user_version")
+    load_generation = cur.fetchone()[0]
+    cur.execute("PRAGMA user_version = %d" % (load_generation + 1))
+
+
+class QueryResultCache:
+    """
+    In-process LRU cache of get_rows_from_query results keyed by database, SQL text and parameters. An entry is only
+    served while the database's load generation is unchanged and it is younger than ttl_seconds (None for no limit),
+    so results are never stale once a load commits. Only use it for read queries.
+    
+    Checking the load generation still opens the database briefly to read its header, which is far cheaper than
+    running the query again. No connection is kept open between calls, so the cache never holds a lock on the file.
+    
+    """
+    
+    def __init__(self, max_entries=1024, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _get_load_generation(self, database_file_name):
+        """
+        Returns the database file's identity along with its load generation. Raises FileNotFoundError if the
+        database does not exist. The identity, together with create_nih_tables starting each new database at a
+        random generation, keeps results from a deleted database being served for a new one at the same path.
+        """
+        file_stat = os.stat(database_file_name)
+        
+        con = sqlite.connect(database_file_name)
+        try:
+            load_generation = con.execute("PRAGMA user_version").fetchone()[0]
+        finally:
+            con.close()
+        
+        return file_stat.st_dev, file_stat.st_ino, load_generation
+    
+    def get_rows(self, database_file_name, sql_query, parameters=None):
+        """Same as get_rows_from_query but served from the cache when possible."""
+        database_file_name = os.path.abspath(database_file_name)
+        
+        if parameters is None:
+            frozen_parameters = None
+        elif isinstance(parameters, dict):
+            frozen_parameters = tuple(sorted(parameters.items()))
+        else:
+            frozen_parameters = tuple(parameters)
+        key = (database_file_name, sql_query, frozen_parameters)
+        
+        # The generation is read before running the query, so a load committing in between leaves the new rows
+        # tagged with the old generation and they are simply fetched again next time.
+        try:
+            load_generation = self._get_load_generation(database_file_name)
+        except FileNotFoundError:
+            # Nothing to cache, so behave exactly like get_rows_from_query does for a missing database.
+            return get_rows_from_query(database_file_name, sql_query, parameters)
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_generation, entry_time, rows = entry
+                if entry_generation == load_generation and (self.ttl_seconds is None or time.monotonic() - entry_time < self.ttl_seconds):
+                    self._entries.move_to_end(key)
+                    return list(rows)
+                
+                del self._entries[key]
+        
+        rows = get_rows_from_query(database_file_name, sql_query, parameters)
+        
+        with self._lock:
+            self._entries[key] = (load_generation, time.monotonic(), rows)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        
+        return list(rows)
+    
+    def clear(self):
+        """Drop all cached results."""
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared cache used by get_cached_rows_from_query.
+query_result_cache = QueryResultCache()
+
+
+def get_cached_rows_from_query(database_file_name, sql_query, parameters=None):
+    """Same as get_rows_from_query but served from the shared in-process query_result_cache when possible."""
+    return query_result_cache.get_rows(database_file_name, sql_query, parameters)
+
+
 def update_source_file_precedence(database_file_name='nih_database.db'):
     """For each NIH_SOURCE_FILE record, update its source_file_precedence with an integer such that smaller integers correspond to more recent
     files. Recent files are sorted by fiscal year then by date."""
@@ -262,16 +474,22 @@ def update_source_file_precedence(database_file_name='nih_database.db'):
         
         # This update makes me sick but since we are using sqlite instead of Oracle or SQL Server, I couldn't
         # think of another way of applying the ordering update within sqlite, so I am forced to do so through python.
+        # Only rows whose order changes are touched so that we can tell whether cached results need invalidating.
+        changed_row_count = 0
         i = 1
         for row in rows:
             cur.execute("""
                 UPDATE NIH_SOURCE_FILE
                 SET    source_file_precedence_order = ?
                 WHERE  nih_source_file_id = ?
-            """, (i, row['nih_source_file_id']))
+                AND    source_file_precedence_order IS NOT ?
+            """, (i, row['nih_source_file_id'], i))
+            changed_row_count += cur.rowcount
             
             i += 1;
         
+        if changed_row_count > 0:
+            increment_load_generation(cur)
         con.commit()
     
 
@@ -287,17 +505,8 @@ def update_current_application_id(database_file_name='nih_database.db'):
     with con:
         cur = con.cursor() 
     
-        # Reset all previous flags to N.
-        cur.execute("""
-            UPDATE NIH_PROJECT
-            SET    is_current_application_id = 'N'
-        """)
-        
-        # Find the most recent version of each application_id and set it to Y.
-        cur.execute("""
-            UPDATE NIH_PROJECT
-            SET    is_current_application_id = 'Y'
-            WHERE  nih_project_id IN (
+        # The most recent version of each application_id.
+        current_projects = """
                     SELECT  np.nih_project_id
                     FROM    NIH_PROJECT np
                             JOIN NIH_SOURCE_FILE nsf
@@ -312,20 +521,41 @@ def update_current_application_id(database_file_name='nih_database.db'):
                             ) mfy
                                 ON np.application_id = mfy.application_id
                                 AND nsf.source_file_precedence_order = mfy.min_source_file_precedence_order
-                    )
+        """
+        
+        # Only flip the flags that are wrong, rather than resetting every row to N first, so that we can tell whether
+        # cached results need invalidating.
+        cur.execute("""
+            UPDATE NIH_PROJECT
+            SET    is_current_application_id = 'N'
+            WHERE  is_current_application_id = 'Y'
+            AND    nih_project_id NOT IN (""" + current_projects + """)
+        """)
+        changed_row_count = cur.rowcount
+        
+        cur.execute("""
+            UPDATE NIH_PROJECT
+            SET    is_current_application_id = 'Y'
+            WHERE  is_current_application_id = 'N'
+            AND    nih_project_id IN (""" + current_projects + """)
         """)
+        changed_row_count += cur.rowcount
         
+        if changed_row_count > 0:
+            increment_load_generation(cur)
         con.commit()
 
 
-def load_fiscal_year_range(fiscal_year_start, fiscal_year_end, database_file_name='nih_database.db', is_store_terms=False, is_store_investigators=False):
+def load_fiscal_year_range(fiscal_year_start, fiscal_year_end, database_file_name='nih_database.db', is_store_terms=False, is_store_investigators=False,
+                           is_compact_storage=False):
     """
     For a range of fiscal years, download into a sqlite database all NIH award data. 
     This is the main workhorse for this module and admittedly monolithic which was born out
-    of expedience.
+    of expedience. is_compact_storage must match how the database was first created, otherwise a RuntimeError is
+    raised, and date parameters for queries against a compact database must be wrapped in DayNumber.
     """
     # Create sqlite tables
-    create_nih_tables(database_file_name, is_store_terms, is_store_investigators)
+    create_nih_tables(database_file_name, is_store_terms, is_store_investigators, is_compact_storage)
     
     # Set up the NIH award file object to get files for a range of years
     award_file = NIHAwardFile(fiscal_year_start, fiscal_year_end)
@@ -334,6 +564,10 @@ def load_fiscal_year_range(fiscal_year_start, fiscal_year_end, database_file_nam
     award_file.get_files_in_fiscal_year_range()
   
     con = sqlite.connect(database_file_name, detect_types=sqlite.PARSE_DECLTYPES)
+    
+    # Whether the open transaction has inserted projects. The load generation is only bumped for commits that change
+    # data so that loads with nothing new keep cached results.
+    is_project_inserted = False
      
     try:
         with con:
@@ -344,8 +578,11 @@ def load_fiscal_year_range(fiscal_year_start, fiscal_year_end, database_file_nam
                 # Are we at the beginning of a new file? 0 = Yes.
                 if award.source_file_row_number == 0:
                     
-                    #if there was an open transaction (perhaps from a previous file) commit it.
+                    #if there was an open transaction (perhaps from a previous file) commit it along with a new load generation.
+                    if is_project_inserted:
+                        increment_load_generation(cur)
                     con.commit()
+                    is_project_inserted = False
                     
                     # Assume that this source file has not been loaded into the database.
                     is_source_file_loaded = False
@@ -353,6 +590,7 @@ def load_fiscal_year_range(fiscal_year_start, fiscal_year_end, database_file_nam
                     try:
                         # Create a new source file row in the database
                         cur_file_id = insert_source_file(cur, award.source_file_name, award.source_file_date, award.source_fiscal_year)
+                        increment_load_generation(cur)
                         con.commit()
                     except sqlite.IntegrityError:
                         # Assume that the IntegrityError resulted from a unique key violation. So lookup the key.
@@ -370,7 +608,12 @@ def load_fiscal_year_range(fiscal_year_start, fiscal_year_end, database_file_nam
                 # Insert all specified parts of the award file IF the file hasn't already been loaded.
                 # If it has been loaded, then skip the insert until we come to something new.
                 if not is_source_file_loaded:
-                    insert_award_file(cur, award, cur_file_id, is_store_terms, is_store_investigators)
+                    insert_award_file(cur, award, cur_file_id, is_store_terms, is_store_investigators, is_compact_storage)
+                    is_project_inserted = True
+            
+            # The last file is committed when leaving the with block.
+            if is_project_inserted:
+                increment_load_generation(cur)
                         
     except:
         print("ERROR: Failed to load NIH source file", award.source_file_name, award.source_file_date)
@@ -378,6 +621,9 @@ def load_fiscal_year_range(fiscal_year_start, fiscal_year_end, database_file_nam
     
     print("Imported all files.")
 
+    # These only change rows (and bump the load generation) when something is out of date, so they are cheap to
+    # rerun after a load with nothing new and still repair a previous load that failed before reaching them.
+
     # Lastly, update the source file precedences given our new files.
     update_source_file_precedence(database_file_name)
     print("Updated source file precedence.")
@@ -386,20 +632,196 @@ def load_fiscal_year_range(fiscal_year_start, fiscal_year_end, database_file_nam
     print("Updated current application_ids.")
 
 
-def main():
-    #change current working directory
-    os.chdir('C:/Users/Britton/Documents/test')
+def parse_xml_file(xml_file, batch_size, columns_directory):
+    """
+    Parse one downloaded XML file (an entry of NIHAwardFile.xml_files) into columnar .npy batches under
+    columns_directory, replacing any from a previous run. Returns the number of rows parsed. This is a top level
+    function so that it can run in a worker process.
+    """
+    # Only the columnar parse needs numpy, so it is imported here rather than for every use of this module.
+    from nihcolumns import award_batches
+    
+    award_file = NIHAwardFile(xml_file["fiscal_year"])
+    award_file.xml_files = [xml_file]
+    
+    spill_directory = os.path.join(columns_directory, os.path.splitext(os.path.basename(xml_file["xml_file"]))[0])
+    if os.path.isdir(spill_directory):
+        shutil.rmtree(spill_directory)
+    
+    row_count = 0
+    for batch in award_batches(award_file, batch_size, spill_directory=spill_directory):
+        row_count += len(batch)
+    
+    return row_count
+
+
+def parse_fiscal_year_range(fiscal_year_start, fiscal_year_end, columns_directory='columns', batch_size=65536, workers=1):
+    """For a range of fiscal years, download the NIH award files if needed and parse each one into columnar .npy
+    batches under columns_directory, using up to workers processes."""
+    award_file = NIHAwardFile(fiscal_year_start, fiscal_year_end)
+    award_file.get_files_in_fiscal_year_range()
+    
+    if workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            row_counts = list(executor.map(parse_xml_file, award_file.xml_files,
+                                           [batch_size] * len(award_file.xml_files), [columns_directory] * len(award_file.xml_files)))
+    else:
+        row_counts = [parse_xml_file(xml_file, batch_size, columns_directory) for xml_file in award_file.xml_files]
+    
+    for xml_file, row_count in zip(award_file.xml_files, row_counts):
+        print("Parsed", row_count, "rows from", xml_file["xml_file"])
+
+
+def run_command(args):
+    """Run the command chosen on the command line."""
+    if args.command == 'download':
+        award_file = NIHAwardFile(args.start, args.end)
+        award_file.get_files_in_fiscal_year_range()
+    
+    elif args.command == 'parse':
+        parse_fiscal_year_range(args.start, args.end, args.columns_dir, args.batch_size, args.workers)
+    
+    elif args.command == 'load':
+        load_fiscal_year_range(args.start, args.end, args.database, args.terms, args.investigators, args.compact)
+    
+    elif args.command == 'update':
+        update_source_file_precedence(args.database)
+        print("Updated source file precedence.")
+        
+        update_current_application_id(args.database)
+        print("Updated current application_ids.")
+
+
+def run_profiled(args, report_prefix):
+    """Run the command under cProfile and tracemalloc, writing report_prefix.prof (pstats data) and
+    report_prefix.txt (top functions by cumulative time plus the largest memory allocations)."""
+    import cProfile
+    import pstats
+    import tracemalloc
+    
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    
+    try:
+        profiler.runcall(run_command, args)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        
+        profiler.dump_stats(report_prefix + '.prof')
+        
+        with open(report_prefix + '.txt', 'w') as report:
+            report.write("Traced memory: current %d bytes, peak %d bytes\n\n" % (current_memory, peak_memory))
+            report.write("Top allocations by line:\n")
+            for stat in snapshot.statistics('lineno')[:25]:
+                report.write(str(stat) + "\n")
+            
+            report.write("\nTop functions by cumulative time:\n")
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(40)
+        
+        print("Wrote profile reports:", report_prefix + '.prof', report_prefix + '.txt')
+
+
+def fiscal_year_argument(value):
+    """argparse type for --start and --end that accepts the same years NIHAwardFile does."""
+    import argparse
+    
+    if re.match(NIHAwardFile.RE_FISCAL_YEAR, value) is None:
+        raise argparse.ArgumentTypeError('%r is not a 4 digit fiscal year' % value)
+    
+    return value.strip()
+
+
+def parse_arguments(argv=None):
+    """Parse the command line for main()."""
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog='python -m nihloader',
+                                     description='Download, parse and load NIH ExPORTER award files into a sqlite database.')
+    parser.add_argument('command', nargs='?', default='load', choices=['download', 'parse', 'load', 'update'],
+                        help='download: fetch and unzip XML files. parse: parse XML files into columnar .npy batches. '
+                             'load: download then insert into the database and run the updates (default). '
+                             'update: rerun the post-load source file precedence and current application_id updates.')
+    parser.add_argument('--start', type=fiscal_year_argument, default=None, help='first fiscal year (default: 2000)')
+    parser.add_argument('--end', type=fiscal_year_argument, default=None,
+                        help='last fiscal year (default: 2013, or the same as --start when --start is given)')
+    parser.add_argument('--database', default='nih_database.db', help='sqlite database file (default: %(default)s)')
+    parser.add_argument('--terms', action='store_true', help='also store project terms')
+    parser.add_argument('--investigators', action='store_true', help='also store principal investigators')
+    parser.add_argument('--compact', action='store_true', help='store dates as day numbers and costs as integers')
+    # The parse only options default to None so that we can tell when they were given to another command.
+    parser.add_argument('--workers', type=int, default=None, help='worker processes for parse (default: 1)')
+    parser.add_argument('--batch-size', type=int, default=None, help='rows per columnar batch for parse (default: 65536)')
+    parser.add_argument('--columns-dir', default=None, help='directory for parsed .npy batches from parse (default: columns)')
+    parser.add_argument('--cache-dir', default='.', help='directory that downloaded XML files are kept in (default: current directory)')
+    parser.add_argument('--profile', action='store_true',
+                        help='write cProfile and tracemalloc reports to nihloader-<command>.prof/.txt in the current directory. '
+                             'Only the main process is profiled, so it cannot be combined with parse --workers above 1.')
+    
+    args = parser.parse_args(argv)
+    
+    # Without any years keep the range the original main() loaded.
+    if args.start is None:
+        args.start = '2000'
+        if args.end is None:
+            args.end = '2013'
+    elif args.end is None:
+        args.end = args.start
+    
+    if int(args.start) > int(args.end):
+        parser.error('--end cannot come before --start')
+    
+    if args.command != 'load':
+        for option, value in (('--terms', args.terms), ('--investigators', args.investigators), ('--compact', args.compact)):
+            if value:
+                parser.error(option + ' is only used by the load command')
+    
+    if args.command == 'parse':
+        if args.workers is None:
+            args.workers = 1
+        if args.batch_size is None:
+            args.batch_size = 65536
+        if args.columns_dir is None:
+            args.columns_dir = 'columns'
+        
+        if args.workers < 1:
+            parser.error('--workers must be at least 1')
+        if args.batch_size < 1:
+            parser.error('--batch-size must be at least 1')
+        if args.profile and args.workers > 1:
+            parser.error('--profile only covers the main process, so it cannot be used with --workers above 1')
+    else:
+        for option, value in (('--workers', args.workers), ('--batch-size', args.batch_size), ('--columns-dir', args.columns_dir)):
+            if value is not None:
+                parser.error(option + ' is only used by the parse command')
+    
+    return args
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    
+    # Paths given on the command line are relative to where we were started, but NIHAwardFile downloads into the
+    # current working directory so resolve them before moving into the cache directory.
+    args.database = os.path.abspath(args.database)
+    if args.columns_dir is not None:
+        args.columns_dir = os.path.abspath(args.columns_dir)
+    report_prefix = os.path.abspath('nihloader-' + args.command)
+    
+    os.makedirs(args.cache_dir, exist_ok=True)
+    os.chdir(args.cache_dir)
     
-    database_file_name = 'nih_database.db'
-    fiscal_year_start = '2000'
-    fiscal_year_end = '2013'
-    # For sake of brevity do not store, terms or investigators
-    is_store_terms = False
-    is_store_investigators = False
-    load_fiscal_year_range(fiscal_year_start, fiscal_year_end, database_file_name, is_store_terms, is_store_investigators)
+    if args.profile:
+        run_profiled(args, report_prefix)
+    else:
+        run_command(args)
 
     print('COMPLETED')
+    return 0
 
 
 if __name__ == "__main__":
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""
+Tests for the nihcolumns module that run against temporary sqlite databases without downloading anything.
+
+@author: Britton Ward (brittonward.com)
+
+"""
+
+
+import os
+import shutil
+import sqlite3 as sqlite
+import tempfile
+import unittest
+from datetime import date
+
+import numpy as np
+
+import nihcolumns
+import nihloader
+from nihaward import NIHAward, NIHAwardFile
+
+
+class ProjectBatchesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database_file_name = os.path.join(self.directory, 'nih_database.db')
+        self.spill_directory = os.path.join(self.directory, 'columns')
+
+        nihloader.create_nih_tables(self.database_file_name, is_compact_storage=True)
+        con = sqlite.connect(self.database_file_name)
+        with con:
+            cur = con.cursor()
+            nih_source_file_id = nihloader.insert_source_file(cur, 'RePORTER_PRJ_X_FY2012.xml', date(2012, 1, 1), '2012')
+            for row_number, administering_ic in enumerate(['CA', 'HL', 'CA', 'GM', 'HL']):
+                award = NIHAward('RePORTER_PRJ_X_FY2012.xml', '2012', '01/01/2012', row_number)
+                award.setattr('APPLICATION_ID', str(row_number + 1))
+                award.setattr('ADMINISTERING_IC', administering_ic)
+                award.setattr('PROJECT_START', '07/15/2012')
+                award.setattr('TOTAL_COST', str(1000 * (row_number + 1)))
+                nihloader.insert_project(cur, award, nih_source_file_id, True)
+        con.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_batches(self):
+        batches = list(nihcolumns.project_batches(self.database_file_name, 2, ['administering_ic', 'project_start', 'total_cost']))
+
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertEqual(sum(batch['total_cost'].sum() for batch in batches), 15000)
+        self.assertEqual(str(batches[0]['project_start'][0]), '2012-07-15')
+        self.assertEqual(batches[2].decode('administering_ic').tolist(), ['HL'])
+
+    def test_spill_stopped_early(self):
+        for batch in nihcolumns.project_batches(self.database_file_name, 2, ['administering_ic', 'total_cost'],
+                                                spill_directory=self.spill_directory):
+            break
+
+        batches = list(nihcolumns.load_spilled_batches(self.spill_directory))
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0].decode('administering_ic').tolist(), ['CA', 'HL'])
+
+    def test_empty_fields(self):
+        with self.assertRaises(RuntimeError):
+            next(nihcolumns.project_batches(self.database_file_name, 2, []))
+
+
+class AwardBatchesTest(unittest.TestCase):
+
+    XML = """<?xml version="1.0" encoding="UTF-8"?>
+<PROJECTS><row><APPLICATION_ID>1</APPLICATION_ID><FY>2012</FY><PROJECT_START>07/15/2012</PROJECT_START><TOTAL_COST>2000000</TOTAL_COST><ORG_STATE>MD</ORG_STATE></row>
+<row><APPLICATION_ID>2</APPLICATION_ID><FY>2012</FY><TOTAL_COST>500000</TOTAL_COST><ORG_STATE>VA</ORG_STATE></row>
+<row><APPLICATION_ID>3</APPLICATION_ID><FY>2012</FY><PROJECT_START>2011-09-01</PROJECT_START><ORG_STATE>MD</ORG_STATE></row></PROJECTS>
+"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.spill_directory = os.path.join(self.directory, 'columns')
+
+        xml_file = os.path.join(self.directory, 'RePORTER_PRJ_X_FY2012.xml')
+        with open(xml_file, 'w') as f:
+            f.write(self.XML)
+
+        self.award_file = NIHAwardFile('2012')
+        self.award_file.xml_files = [{"fiscal_year": "2012", "file_date": "01/01/2012", "xml_file": xml_file}]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_batches(self, batches):
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+
+        application_id = np.concatenate([batch['application_id'] for batch in batches])
+        self.assertEqual(application_id.dtype, np.int64)
+        self.assertEqual(application_id.tolist(), [1, 2, 3])
+
+        total_cost = np.concatenate([batch['total_cost'] for batch in batches])
+        self.assertEqual(total_cost.tolist(), [2000000, 500000, 0])
+
+        project_start = np.concatenate([batch['project_start'] for batch in batches])
+        self.assertEqual(project_start.dtype, np.dtype('datetime64[D]'))
+        self.assertEqual(str(project_start[0]), '2012-07-15')
+        self.assertTrue(np.isnat(project_start[1]))
+        self.assertEqual(str(project_start[2]), '2011-09-01')
+
+        org_state = np.concatenate([batch.decode('org_state') for batch in batches])
+        self.assertEqual(org_state.tolist(), ['MD', 'VA', 'MD'])
+
+    def test_spill_and_reload(self):
+        fields = ['application_id', 'total_cost', 'project_start', 'org_state']
+        self.check_batches(list(nihcolumns.award_batches(self.award_file, 2, fields, spill_directory=self.spill_directory)))
+        self.check_batches(list(nihcolumns.load_spilled_batches(self.spill_directory)))
+
+
+if __name__ == '__main__':
+    unittest.main()
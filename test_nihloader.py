@@ -0,0 +1,237 @@
+"""
+Tests for the nihloader module that run against temporary sqlite databases without downloading anything.
+
+@author: Britton Ward (brittonward.com)
+
+"""
+
+
+import os
+import shutil
+import sqlite3 as sqlite
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+
+import nihloader
+from nihaward import NIHAward, NIHAwardFile
+
+
+def make_award(row_number, application_id, project_start, total_cost):
+    """Build an NIHAward the same way NIHAwardFile.awarditer() does from XML tag values."""
+    award = NIHAward('RePORTER_PRJ_X_FY2012.xml', '2012', '01/01/2012', row_number)
+    award.setattr('APPLICATION_ID', str(application_id))
+    award.setattr('PROJECT_START', project_start)
+    award.setattr('TOTAL_COST', str(total_cost))
+    return award
+
+
+class CompactStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database_file_name = os.path.join(self.directory, 'nih_database.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load_awards(self, is_compact_storage):
+        nihloader.create_nih_tables(self.database_file_name, is_compact_storage=is_compact_storage)
+        con = sqlite.connect(self.database_file_name)
+        with con:
+            cur = con.cursor()
+            nih_source_file_id = nihloader.insert_source_file(cur, 'RePORTER_PRJ_X_FY2012.xml', date(2012, 1, 1), '2012')
+            nihloader.insert_project(cur, make_award(0, 1, '07/15/2012', 2000000), nih_source_file_id, is_compact_storage)
+            nihloader.insert_project(cur, make_award(1, 2, '08/01/2012', 500000), nih_source_file_id, is_compact_storage)
+            nihloader.insert_project(cur, make_award(2, 3, '2011-07-15', 3000000), nih_source_file_id, is_compact_storage)
+        con.close()
+
+    def test_round_trip(self):
+        self.load_awards(True)
+        rows = nihloader.get_rows_from_query(self.database_file_name,
+                                             "SELECT project_start_date, budget_start, total_cost, typeof(project_start_date) AS date_type "
+                                             "FROM NIH_PROJECT WHERE application_id = 1")
+        self.assertEqual(rows[0]['project_start_date'], date(2012, 7, 15))
+        self.assertIsNone(rows[0]['budget_start'])
+        self.assertEqual(rows[0]['total_cost'], 2000000)
+        self.assertEqual(rows[0]['date_type'], 'integer')
+
+    def test_day_number_parameters(self):
+        self.load_awards(True)
+        sql_query = "SELECT application_id FROM NIH_PROJECT WHERE project_start_date BETWEEN ? AND ? AND total_cost > ?"
+        parameters = (nihloader.DayNumber(date(2012, 7, 1)), nihloader.DayNumber(date(2012, 9, 30)), 1000000)
+
+        rows = nihloader.get_rows_from_query(self.database_file_name, sql_query, parameters)
+        self.assertEqual([row['application_id'] for row in rows], [1])
+
+        rows = nihloader.get_rows_from_query(self.database_file_name, "EXPLAIN QUERY PLAN " + sql_query, parameters)
+        self.assertIn('NIH_PROJECT_IX1', rows[0]['detail'])
+
+    def test_day_number_parameters_cached(self):
+        self.load_awards(True)
+        cache = nihloader.QueryResultCache()
+        sql_query = "SELECT COUNT(*) FROM NIH_PROJECT WHERE project_start_date BETWEEN ? AND ?"
+
+        for i in range(3):
+            rows = cache.get_rows(self.database_file_name, sql_query,
+                                  (nihloader.DayNumber(date(2012, 7, 1)), nihloader.DayNumber(date(2012, 9, 30))))
+            self.assertEqual(rows[0][0], 2)
+
+        self.assertEqual(len(cache._entries), 1)
+        cache.clear()
+
+    def test_storage_mode_mismatch(self):
+        self.load_awards(False)
+        with self.assertRaises(RuntimeError):
+            nihloader.create_nih_tables(self.database_file_name, is_compact_storage=True)
+
+        # The same mode is fine to create again.
+        nihloader.create_nih_tables(self.database_file_name, is_compact_storage=False)
+
+
+class QueryResultCacheTest(unittest.TestCase):
+
+    XML = """<?xml version="1.0" encoding="UTF-8"?>
+<PROJECTS><row><APPLICATION_ID>1</APPLICATION_ID><PROJECT_START>07/15/2012</PROJECT_START><TOTAL_COST>2000000</TOTAL_COST></row>
+<row><APPLICATION_ID>2</APPLICATION_ID><PROJECT_START>08/01/2012</PROJECT_START><TOTAL_COST>500000</TOTAL_COST></row></PROJECTS>
+"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database_file_name = os.path.join(self.directory, 'nih_database.db')
+        self.cache = nihloader.QueryResultCache()
+
+    def tearDown(self):
+        self.cache.clear()
+        shutil.rmtree(self.directory)
+
+    def load_xml_file(self):
+        """Run load_fiscal_year_range over a local XML file instead of downloading from the NIH website."""
+        xml_file = os.path.join(self.directory, 'RePORTER_PRJ_X_FY2012.xml')
+        with open(xml_file, 'w') as f:
+            f.write(self.XML)
+
+        def get_files_in_fiscal_year_range(award_file):
+            award_file.xml_files = [{"fiscal_year": "2012", "file_date": "01/01/2012", "xml_file": xml_file}]
+
+        with mock.patch.object(NIHAwardFile, 'get_files_in_fiscal_year_range', get_files_in_fiscal_year_range):
+            nihloader.load_fiscal_year_range('2012', '2012', self.database_file_name)
+
+    def count_projects(self):
+        return self.cache.get_rows(self.database_file_name, "SELECT COUNT(*) FROM NIH_PROJECT WHERE is_current_application_id = ?", ('Y',))[0][0]
+
+    def test_load_invalidates(self):
+        nihloader.create_nih_tables(self.database_file_name)
+        self.assertEqual(self.count_projects(), 0)
+
+        self.load_xml_file()
+        self.assertEqual(self.count_projects(), 2)
+
+        rows = self.cache.get_rows(self.database_file_name, "SELECT COUNT(*) FROM NIH_SOURCE_FILE")
+        self.assertEqual(rows[0][0], 1)
+
+    def test_generation_bump(self):
+        self.load_xml_file()
+        self.assertEqual(self.count_projects(), 2)
+
+        # A change without a new load generation is not seen until the generation is bumped.
+        con = sqlite.connect(self.database_file_name)
+        cur = con.cursor()
+        cur.execute("UPDATE NIH_PROJECT SET is_current_application_id = 'N' WHERE application_id = 1")
+        con.commit()
+        self.assertEqual(self.count_projects(), 2)
+
+        nihloader.increment_load_generation(cur)
+        con.commit()
+        con.close()
+        self.assertEqual(self.count_projects(), 1)
+
+    def get_load_generation(self):
+        con = sqlite.connect(self.database_file_name)
+        load_generation = con.execute("PRAGMA user_version").fetchone()[0]
+        con.close()
+        return load_generation
+
+    def test_reload_keeps_cache(self):
+        self.load_xml_file()
+        self.assertEqual(self.count_projects(), 2)
+        load_generation = self.get_load_generation()
+
+        # Loading the same file again inserts nothing, so the generation and the cached result are kept.
+        self.load_xml_file()
+        self.assertEqual(self.get_load_generation(), load_generation)
+        with mock.patch.object(nihloader, 'get_rows_from_query') as get_rows_from_query:
+            self.assertEqual(self.count_projects(), 2)
+            get_rows_from_query.assert_not_called()
+
+    def test_missing_database(self):
+        with self.assertRaises(sqlite.OperationalError):
+            self.count_projects()
+        self.assertEqual(len(self.cache._entries), 0)
+
+    def test_recreated_database(self):
+        nihloader.create_nih_tables(self.database_file_name)
+        self.assertEqual(self.count_projects(), 0)
+
+        # The new database is back at load generation 0, the same as the cached result was read at.
+        os.remove(self.database_file_name)
+        nihloader.create_nih_tables(self.database_file_name)
+        con = sqlite.connect(self.database_file_name)
+        with con:
+            cur = con.cursor()
+            nih_source_file_id = nihloader.insert_source_file(cur, 'RePORTER_PRJ_X_FY2012.xml', date(2012, 1, 1), '2012')
+            nih_project_id = nihloader.insert_project(cur, make_award(0, 1, '07/15/2012', 2000000), nih_source_file_id)
+            cur.execute("UPDATE NIH_PROJECT SET is_current_application_id = 'Y' WHERE nih_project_id = ?", (nih_project_id,))
+        con.close()
+        self.assertEqual(self.count_projects(), 1)
+
+
+class ParseArgumentsTest(unittest.TestCase):
+
+    def assertParserError(self, argv):
+        with mock.patch('sys.stderr'), self.assertRaises(SystemExit):
+            nihloader.parse_arguments(argv)
+
+    def test_defaults(self):
+        args = nihloader.parse_arguments([])
+        self.assertEqual(args.command, 'load')
+        self.assertEqual((args.start, args.end), ('2000', '2013'))
+        self.assertEqual(args.database, 'nih_database.db')
+        self.assertIsNone(args.workers)
+
+        args = nihloader.parse_arguments(['parse'])
+        self.assertEqual((args.workers, args.batch_size, args.columns_dir), (1, 65536, 'columns'))
+
+    def test_years(self):
+        args = nihloader.parse_arguments(['--start', '2005'])
+        self.assertEqual((args.start, args.end), ('2005', '2005'))
+
+        args = nihloader.parse_arguments(['download', '--start', '2001', '--end', '2003'])
+        self.assertEqual((args.start, args.end), ('2001', '2003'))
+
+        self.assertParserError(['--start', 'abcd'])
+        self.assertParserError(['--start', '2010', '--end', '2009'])
+
+    def test_command_options(self):
+        args = nihloader.parse_arguments(['load', '--terms', '--investigators', '--compact'])
+        self.assertTrue(args.terms and args.investigators and args.compact)
+
+        args = nihloader.parse_arguments(['parse', '--workers', '4', '--batch-size', '100', '--columns-dir', 'out'])
+        self.assertEqual((args.workers, args.batch_size, args.columns_dir), (4, 100, 'out'))
+
+        self.assertParserError(['load', '--workers', '2'])
+        self.assertParserError(['download', '--batch-size', '100'])
+        self.assertParserError(['update', '--columns-dir', 'out'])
+        self.assertParserError(['parse', '--compact'])
+        self.assertParserError(['update', '--terms'])
+        self.assertParserError(['parse', '--workers', '0'])
+
+    def test_profile(self):
+        self.assertTrue(nihloader.parse_arguments(['parse', '--profile']).profile)
+        self.assertTrue(nihloader.parse_arguments(['load', '--profile']).profile)
+        self.assertParserError(['parse', '--workers', '2', '--profile'])
+
+
+if __name__ == '__main__':
+    unittest.main()